@@ -1,5 +1,9 @@
+import asyncio
 import base64
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Annotated
 
 from a2a.types import (
@@ -28,14 +32,106 @@ from beeai_framework.agents.requirement import RequirementAgent
 from beeai_framework.agents.requirement.events import RequirementAgentFinalAnswerEvent
 from beeai_framework.agents.requirement.requirements.conditional import ConditionalRequirement
 from beeai_framework.backend import ChatModelParameters
+from beeai_framework.logger import Logger
 from beeai_framework.tools import tool
 from beeai_framework.tools.mcp import MCPTool
+from beeai_framework.tools.mcp.utils.session_provider import MCPSessionProvider
+from mcp import ClientSession
 from mcp.client.streamable_http import streamablehttp_client
 
 from src.agentstack_agents.visualize import prepare_flight_data, create_static_map, create_interactive_map
 
+logger = Logger(__name__)
+
 server = Server()
 
+KIWI_MCP_URL = "https://mcp.kiwi.com"
+
+KIWI_PING_TIMEOUT = 5  # seconds
+
+# Kiwi MCP session and its tools, shared by all agent runs
+_kiwi_session: ClientSession | None = None
+_kiwi_tools: list[MCPTool] = []
+_kiwi_tools_lock = asyncio.Lock()
+
+
+def _new_render_pool() -> ProcessPoolExecutor:
+    """Create the process pool rendering static maps"""
+    # The static map is CPU-bound and mostly holds the GIL, so it is rendered in separate processes.
+    # Workers are spawned rather than forked, because the server process already runs threads and an event loop.
+    return ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+
+
+_render_pool = _new_render_pool()
+
+
+async def _get_kiwi_tools() -> list[MCPTool]:
+    """Connect to the Kiwi MCP server on first use and reuse the session and tool list while it is alive"""
+    global _kiwi_session, _kiwi_tools
+    async with _kiwi_tools_lock:
+        if _kiwi_session is not None and not await _is_session_alive(_kiwi_session):
+            _release_kiwi_tools()
+
+        if _kiwi_session is None:
+            provider = MCPSessionProvider(streamablehttp_client(KIWI_MCP_URL))
+            session = await provider.session()
+            try:
+                tools = await MCPTool.from_session(session)
+            except Exception:
+                provider.destroy()
+                raise
+            # Same bookkeeping as MCPTool.from_client, every tool holds one reference to the session
+            provider.refs += len(tools)
+            _kiwi_session, _kiwi_tools = session, tools
+
+        return _kiwi_tools
+
+
+async def _is_session_alive(session: ClientSession) -> bool:
+    """Ping the MCP server, the session may have been closed or expired since the last run"""
+    try:
+        await asyncio.wait_for(session.send_ping(), timeout=KIWI_PING_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Kiwi MCP session is no longer usable, reconnecting: {e!r}")
+        return False
+    return True
+
+
+def _release_kiwi_tools() -> None:
+    """Drop the shared Kiwi MCP tools and release their session references, which stops the old session"""
+    global _kiwi_session, _kiwi_tools
+    for _ in _kiwi_tools:
+        MCPSessionProvider.destroy_by_session(_kiwi_session)
+    _kiwi_session, _kiwi_tools = None, []
+
+
+async def _render_static_map(flights_gdf, airports_gdf) -> bytes:
+    """Render the static map in the process pool, replacing the pool once if a worker died"""
+    global _render_pool
+    pool = _render_pool
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, create_static_map, flights_gdf, airports_gdf)
+    except BrokenProcessPool:
+        logger.warning("Map render process pool is broken, starting a new one")
+        # Concurrent renders may have hit the same broken pool, only the first one replaces it
+        if _render_pool is pool:
+            _render_pool = _new_render_pool()
+            pool.shutdown(wait=False)
+        return await loop.run_in_executor(_render_pool, create_static_map, flights_gdf, airports_gdf)
+
+
+def _png_file_part(png_bytes: bytes) -> FilePart:
+    """Send PNG directly as base64 encoded string"""
+    base64_string = base64.b64encode(png_bytes).decode("ascii")
+    return FilePart(file=FileWithBytes(bytes=base64_string, mime_type="image/png", name="flights.png"))
+
+
+async def _html_file_part(html_bytes: bytes) -> FilePart:
+    """Upload HTML file to the Agent Stack server and send it using the Agent Stack SDK"""
+    file = await File.create(filename="flights.html", content=html_bytes, content_type="text/html")
+    return file.to_file_part()
+
 
 @server.agent()
 async def flight_search_agent(
@@ -84,13 +180,16 @@ async def flight_search_agent(
         """
         nonlocal static_png_bytes, interactive_html_bytes
         # Define your flights with waypoints (list of airport codes)
-        flights_gdf, airports_gdf = prepare_flight_data(flights)
-        static_png_bytes = create_static_map(flights_gdf, airports_gdf)
-        interactive_html_bytes = create_interactive_map(flights_gdf, airports_gdf)
+        # Rendering is CPU-bound, run it outside of the event loop to keep it free for other requests
+        flights_gdf, airports_gdf = await asyncio.to_thread(prepare_flight_data, flights)
+        # The interactive map only takes a few milliseconds, less than pickling the data to another process
+        static_png_bytes, interactive_html_bytes = await asyncio.gather(
+            _render_static_map(flights_gdf, airports_gdf),
+            asyncio.to_thread(create_interactive_map, flights_gdf, airports_gdf),
+        )
 
     # Setup MCP Tool for searching flights
-    client = streamablehttp_client("https://mcp.kiwi.com")
-    kiwi_tools = await MCPTool.from_client(client)
+    kiwi_tools = await _get_kiwi_tools()
 
     final_answer = []
 
@@ -109,19 +208,24 @@ async def flight_search_agent(
 
     final_message = AgentMessage(parts=[TextPart(text="".join(final_answer))])
 
-    if static_png_bytes is not None:
-        # Send PNG directly as base64 encoded string
-        base64_string = base64.b64encode(static_png_bytes).decode("utf-8")
-        file_part = FilePart(file=FileWithBytes(bytes=base64_string, mime_type="image/png", name="flights.png"))
-        final_message.parts.append(file_part)
-        yield file_part
-
+    # Start the HTML upload right away, the PNG is sent while it is in flight and does not depend on its outcome
+    html_upload = None
     if interactive_html_bytes is not None:
-        # Upload HTML file to the Agent Stack server and send it using the Agent Stack SDK
-        file = await File.create(filename="flights.html", content=interactive_html_bytes, content_type="text/html")
-        file_part = file.to_file_part()
-        final_message.parts.append(file_part)
-        yield file_part
+        html_upload = asyncio.create_task(_html_file_part(interactive_html_bytes))
+
+    try:
+        if static_png_bytes is not None:
+            file_part = _png_file_part(static_png_bytes)
+            final_message.parts.append(file_part)
+            yield file_part
+
+        if html_upload is not None:
+            file_part = await html_upload
+            final_message.parts.append(file_part)
+            yield file_part
+    finally:
+        if html_upload is not None:
+            html_upload.cancel()
 
     await context.store(final_message)
 
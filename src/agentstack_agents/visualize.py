@@ -1,60 +1,149 @@
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import urllib.request
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
 import airportsdata
 import geopandas as gpd
-import pandas as pd
-import matplotlib.pyplot as plt
+import jinja2
+import matplotlib
 import matplotlib.colors
-from shapely.geometry import Point, LineString
-from io import BytesIO
+import matplotlib.path
+import numpy as np
+import orjson
+import shapely
+from matplotlib.backends.backend_agg import RendererAgg
+from matplotlib.collections import PathCollection
+from matplotlib.figure import Figure
+
+# Maps are only rendered to in-memory buffers, never shown, so use the non-interactive backend
+matplotlib.use("Agg")
+
+WORLD_MAP_URL = "https://naciscdn.org/naturalearth/110m/cultural/ne_110m_admin_0_countries.zip"
+WORLD_MAP_TIMEOUT = 30  # seconds
+CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "agentstack_agents"
+LEAFLET_TEMPLATE = jinja2.Template((Path(__file__).parent / "leaflet.html.j2").read_text(encoding="utf-8"))
+_FLIGHTS_PLACEHOLDER = "__FLIGHTS_GEOJSON__"
+_AIRPORTS_PLACEHOLDER = "__AIRPORTS_GEOJSON__"
+
+# Flight colors from matplotlib colormap (you can change 'tab10' to 'Set1', 'Set2', 'Set3', 'Paired', etc.)
+FLIGHT_COLORS = [matplotlib.colors.rgb2hex(color) for color in matplotlib.colormaps["tab10"].colors]
+
+
+# A single figure is reused by all static maps to avoid setting up a new figure and renderer per request.
+# It is not attached to pyplot, so GeoPandas' draw_idle() calls do not trigger extra full renders.
+_FIGURE = Figure(figsize=(15, 10))
+_AXES = _FIGURE.add_subplot()
+_FIGURE_LOCK = threading.Lock()
+# Only measures text for the figure layout, so it needs no pixel buffer of its own
+_TEXT_RENDERER = RendererAgg(1, 1, _FIGURE.dpi)
+
+
+@lru_cache(maxsize=1)
+def _get_airports():
+    """Load the IATA airports database once, as a code -> row index and arrays of longitudes and latitudes"""
+    airports = airportsdata.load("IATA")
+    code_index = {code: idx for idx, code in enumerate(airports)}
+    lons = np.fromiter((airport["lon"] for airport in airports.values()), dtype=np.float64, count=len(airports))
+    lats = np.fromiter((airport["lat"] for airport in airports.values()), dtype=np.float64, count=len(airports))
+    return code_index, lons, lats
+
+
+def _airport_coordinates(codes):
+    """Look up longitudes and latitudes of the given airport codes"""
+    code_index, lons, lats = _get_airports()
+    idx = np.fromiter((code_index[code] for code in codes), dtype=np.intp, count=len(codes))
+    return lons[idx], lats[idx]
+
+
+@lru_cache(maxsize=1)
+def _get_world():
+    """Load the Natural Earth world map, downloading it to the local cache on first use"""
+    path = CACHE_DIR / Path(WORLD_MAP_URL).name
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Each process downloads to its own temporary file, so concurrent cold starts never share a partial file
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, suffix=".part", delete=False) as tmp_file:
+            try:
+                with urllib.request.urlopen(WORLD_MAP_URL, timeout=WORLD_MAP_TIMEOUT) as response:
+                    shutil.copyfileobj(response, tmp_file)
+                # Flush the download before it becomes visible under the final name
+                tmp_file.close()
+                os.replace(tmp_file.name, path)
+            finally:
+                Path(tmp_file.name).unlink(missing_ok=True)
+    return gpd.read_file(path)
+
+
+@lru_cache(maxsize=1)
+def _get_world_paths():
+    """Convert the world map polygons to matplotlib paths once, so static maps only need to draw them"""
+    polygons = _get_world().geometry.explode(index_parts=False)
+    return [
+        matplotlib.path.Path.make_compound_path(
+            matplotlib.path.Path(np.asarray(polygon.exterior.coords)[:, :2]),
+            *(matplotlib.path.Path(np.asarray(ring.coords)[:, :2]) for ring in polygon.interiors),
+        )
+        for polygon in polygons
+    ]
 
 
-def prepare_flight_data(flights):
-    """Prepare GeoDataFrames for flights and airports with waypoint support"""
+def _to_script_json(data):
+    """Serialize data to UTF-8 encoded JSON that can be safely embedded in a <script> tag"""
+    return orjson.dumps(data).replace(b"<", b"\\u003c")
 
-    airports = airportsdata.load("IATA")
 
-    # Generate colors from matplotlib colormap (you can change 'tab10' to 'Set1', 'Set2', 'Set3', 'Paired', etc.)
-    cmap = plt.cm.get_cmap("tab10")
+@lru_cache(maxsize=1)
+def _get_leaflet_page_parts():
+    """Render the Leaflet page once around the map data placeholders and split it into pre-encoded parts"""
+    page = LEAFLET_TEMPLATE.render(
+        center=_to_script_json([30.0, 0.0]).decode("utf-8"),
+        zoom=2,
+        flights=_FLIGHTS_PLACEHOLDER,
+        airports=_AIRPORTS_PLACEHOLDER,
+    ).encode("utf-8")
+    head, rest = page.split(_FLIGHTS_PLACEHOLDER.encode("utf-8"))
+    middle, tail = rest.split(_AIRPORTS_PLACEHOLDER.encode("utf-8"))
+    return head, middle, tail
+
+
+def prepare_flight_data(flights):
+    """Prepare GeoDataFrames for flights and airports with waypoint support"""
 
     # Create flight segments (each leg between waypoints)
-    flight_lines = []
+    segment_codes = []
     flight_labels = []
     flight_colors = []
 
     for flight_idx, flight in enumerate(flights):
         # Get color from the palette
-        color = matplotlib.colors.rgb2hex(cmap(flight_idx % cmap.N))
+        color = FLIGHT_COLORS[flight_idx % len(FLIGHT_COLORS)]
 
-        # Create segments between consecutive waypoints
-        for i in range(len(flight) - 1):
-            origin = flight[i]
-            dest = flight[i + 1]
-
-            line = LineString(
-                [(airports[origin]["lon"], airports[origin]["lat"]), (airports[dest]["lon"], airports[dest]["lat"])]
-            )
-            flight_lines.append(line)
+        # Label shows the full route
+        full_route = " → ".join(flight)
 
-            # Label shows the full route
-            full_route = " → ".join(flight)
-            segment_label = f"{origin} → {dest} (part of {full_route})"
-            flight_labels.append(segment_label)
+        # Create segments between consecutive waypoints
+        for origin, dest in itertools.pairwise(flight):
+            segment_codes.extend((origin, dest))
+            flight_labels.append(f"{origin} → {dest} (part of {full_route})")
             flight_colors.append(color)
 
+    # Build all segment geometries at once, each segment being a (2 points x 2 coords) block
+    lons, lats = _airport_coordinates(segment_codes)
+    flight_lines = shapely.linestrings(np.column_stack((lons, lats)).reshape(-1, 2, 2))
+
     flights_gdf = gpd.GeoDataFrame(
         {"route": flight_labels, "color": flight_colors}, geometry=flight_lines, crs="EPSG:4326"
     )
 
-    # Create airports (deduplicated from all waypoints)
-    airport_points = []
-    airport_codes = []
-    seen_codes = set()
-
-    for flight in flights:
-        for code in flight:
-            if code not in seen_codes:
-                airport_points.append(Point(airports[code]["lon"], airports[code]["lat"]))
-                airport_codes.append(code)
-                seen_codes.add(code)
+    # Create airports (deduplicated from all waypoints, keeping first-seen order)
+    airport_codes = list(dict.fromkeys(code for flight in flights for code in flight))
+    airport_points = shapely.points(*_airport_coordinates(airport_codes))
 
     airports_gdf = gpd.GeoDataFrame({"code": airport_codes}, geometry=airport_points, crs="EPSG:4326")
 
@@ -62,83 +151,105 @@ def prepare_flight_data(flights):
 
 
 def create_interactive_map(flights_gdf, airports_gdf):
-    """Create interactive Folium map and return as HTML string"""
-    import folium
-
-    # Create base map
-    m = folium.Map(location=[30.0, 0.0], zoom_start=2)
-
-    # Add each flight path with its color
-    for idx, row in flights_gdf.iterrows():
-        folium.PolyLine(
-            locations=[(coord[1], coord[0]) for coord in row.geometry.coords],
-            color=row["color"],
-            weight=3,
-            opacity=0.7,
-            tooltip=row["route"],
-        ).add_to(m)
-
-    # Add airports
-    for idx, row in airports_gdf.iterrows():
-        folium.CircleMarker(
-            location=[row.geometry.y, row.geometry.x],
-            radius=8,
-            color="blue",
-            fill=True,
-            fillColor="blue",
-            fillOpacity=0.7,
-            tooltip=row["code"],
-        ).add_to(m)
-
-    return m.get_root().render().encode("utf-8")
+    """Create interactive Leaflet map and return as HTML bytes"""
+    # Only the map data changes between requests, it is spliced as JSON bytes between the pre-rendered page parts
+    head, middle, tail = _get_leaflet_page_parts()
+    return b"".join(
+        (
+            head,
+            # Each dataframe becomes a single GeoJSON layer instead of one Leaflet object per row
+            _to_script_json(flights_gdf.to_geo_dict(drop_id=True)),
+            middle,
+            _to_script_json(airports_gdf.to_geo_dict(drop_id=True)),
+            tail,
+        )
+    )
+
+
+def _label_extent(labels):
+    """Return how far (in inches) the boxed airport labels reach right of and above their airports"""
+    width, height = 0.0, 0.0
+    for label in labels:
+        # The offset and the box size are in points, so they do not depend on the figure size or axis limits
+        label.update_positions(_TEXT_RENDERER)
+        label.update_bbox_position_size(_TEXT_RENDERER)
+        box = label.get_bbox_patch().get_window_extent(_TEXT_RENDERER)
+        x, y = _AXES.transData.transform(label.xy)
+        width, height = max(width, box.x1 - x), max(height, box.y1 - y)
+    return width / _FIGURE.dpi, height / _FIGURE.dpi
 
 
 def create_static_map(flights_gdf, airports_gdf):
     """Create static PNG map cropped to flight area and return as bytes"""
-    # Load world map
-    world = gpd.read_file("https://naciscdn.org/naturalearth/110m/cultural/ne_110m_admin_0_countries.zip")
-
-    # Calculate bounds from all geometries
-    all_bounds = gpd.GeoDataFrame(pd.concat([flights_gdf, airports_gdf], ignore_index=True))
-    minx, miny, maxx, maxy = all_bounds.total_bounds
+    # Combine both layers' own bounds, which avoids merging their geometries into a temporary frame
+    # (fmin/fmax skip the NaN bounds of an empty layer, e.g. no flight segments for a single airport)
+    flights_bounds = flights_gdf.total_bounds
+    airports_bounds = airports_gdf.total_bounds
+    minx, miny = np.fmin(flights_bounds[:2], airports_bounds[:2])
+    maxx, maxy = np.fmax(flights_bounds[2:], airports_bounds[2:])
 
     # Add padding (10% on each side)
     padding_x = (maxx - minx) * 0.1
     padding_y = (maxy - miny) * 0.1
 
-    fig, ax = plt.subplots(figsize=(15, 10))
-
-    # Plot world map
-    world.plot(ax=ax, color="lightgray", edgecolor="black", linewidth=0.5)
-
-    # Plot flight paths with colors from the dataframe
-    flights_gdf.plot(ax=ax, color=flights_gdf["color"], linewidth=2, alpha=0.7, zorder=2)
-
-    # Plot airports
-    airports_gdf.plot(ax=ax, color="blue", markersize=100, alpha=0.9, zorder=3)
+    # Matplotlib is not thread-safe, so the shared figure is drawn by one request at a time
+    with _FIGURE_LOCK:
+        _AXES.clear()
 
-    # Add airport labels
-    for _, row in airports_gdf.iterrows():
-        ax.annotate(
-            row["code"],
-            xy=(row.geometry.x, row.geometry.y),
-            xytext=(5, 5),
-            textcoords="offset points",
-            fontsize=10,
-            fontweight="bold",
-            bbox=dict(boxstyle="round,pad=0.3", facecolor="yellow", alpha=0.7),
+        # Plot world map from the pre-built country outlines
+        _AXES.add_collection(
+            PathCollection(_get_world_paths(), facecolor="lightgray", edgecolor="black", linewidth=0.5)
         )
 
-    # Crop to flight area
-    ax.set_xlim(minx - padding_x, maxx + padding_x)
-    ax.set_ylim(miny - padding_y, maxy + padding_y)
-
-    plt.title("Flight Paths", fontsize=16, fontweight="bold")
-    ax.set_axis_off()
+        # Plot flight paths with colors from the dataframe
+        flights_gdf.plot(ax=_AXES, color=flights_gdf["color"], linewidth=2, alpha=0.7, zorder=2)
+
+        # Plot airports
+        airports_gdf.plot(ax=_AXES, color="blue", markersize=100, alpha=0.9, zorder=3)
+
+        # Add airport labels
+        labels = [
+            _AXES.annotate(
+                row["code"],
+                xy=(row.geometry.x, row.geometry.y),
+                xytext=(5, 5),
+                textcoords="offset points",
+                fontsize=10,
+                fontweight="bold",
+                bbox=dict(boxstyle="round,pad=0.3", facecolor="yellow", alpha=0.7),
+            )
+            for _, row in airports_gdf.iterrows()
+        ]
+
+        # Crop to flight area
+        _AXES.set_xlim(minx - padding_x, maxx + padding_x)
+        _AXES.set_ylim(miny - padding_y, maxy + padding_y)
+
+        _AXES.set_title("Flight Paths", fontsize=16, fontweight="bold")
+        _AXES.set_axis_off()
+
+        # Fit the figure to the cropped area up front instead of trimming whitespace with bbox_inches="tight",
+        # which needs an extra render pass (the map stays within the original 15x10 inches)
+        x0, x1 = _AXES.get_xlim()
+        y0, y1 = _AXES.get_ylim()
+        aspect = _AXES.get_aspect()
+        ratio = (aspect if isinstance(aspect, float) else 1.0) * (y1 - y0) / (x1 - x0)
+        map_width, map_height = (15, 15 * ratio) if ratio <= 10 / 15 else (10 / ratio, 10)
+        # Labels stick out right of and above their airports, which may lie right at the edge of the map
+        label_width, label_height = _label_extent(labels)
+        margin, title_height = 0.1, 0.6
+        right_margin, top_margin = margin + label_width, title_height + label_height
+        fig_width, fig_height = map_width + margin + right_margin, map_height + margin + top_margin
+        _FIGURE.set_size_inches(fig_width, fig_height)
+        _FIGURE.subplots_adjust(
+            left=margin / fig_width,
+            right=1 - right_margin / fig_width,
+            bottom=margin / fig_height,
+            top=1 - top_margin / fig_height,
+        )
 
-    # Save to BytesIO buffer in memory
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png", dpi=300, bbox_inches="tight", facecolor="white")
-    plt.close(fig)
-    buffer.seek(0)
+        # Save to BytesIO buffer in memory
+        buffer = BytesIO()
+        _FIGURE.savefig(buffer, format="png", dpi=120, facecolor="white")
+        buffer.seek(0)
     return buffer.read()
\ No newline at end of file